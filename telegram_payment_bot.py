@@ -7,27 +7,40 @@ MANUAL: Crypto & Remitly still require Admin Approval.
 
 import os
 import base64
-import json
+import orjson
+import msgpack
+import mmap
+import re
 from PIL import Image, ImageDraw, ImageFont
 from pathlib import Path
 from io import BytesIO
-import requests
+import httpx
 import time
+import uuid
 import hmac
 import hashlib
 import threading
-import qrcode
+import segno
 import asyncio
 import signal
+import atexit
+import logging
+import logging.handlers
+import queue
+import weakref
 from typing import Dict, Any
+from functools import lru_cache, wraps
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import sys
-from flask import Flask, request, jsonify
+from aiohttp import web
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
 )
 from telegram.ext import (
+    AIORateLimiter,
     ApplicationBuilder,
     CommandHandler,
     CallbackQueryHandler,
@@ -35,28 +48,62 @@ from telegram.ext import (
     ContextTypes,
     filters,
 )
+from telegram.error import RetryAfter
+
+# -------------------- Logging --------------------
+# handlers only enqueue; a listener thread does the actual stdout writes
+LOG_QUEUE = queue.SimpleQueue()
+log = logging.getLogger("bot")
+log.setLevel(logging.INFO)
+log.propagate = False
+log.addHandler(logging.handlers.QueueHandler(LOG_QUEUE))
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+LOG_LISTENER = logging.handlers.QueueListener(LOG_QUEUE, _log_stream)
+LOG_LISTENER.start()
+atexit.register(LOG_LISTENER.stop)
 
 # -------------------- Configuration & storage --------------------
 COUNTDOWN_TASKS = {}
 DATA_DIR = Path(os.environ.get("DATA_DIR", "/data"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
-DB_FILE = DATA_DIR / "payments.json"
+DB_FILE = DATA_DIR / "payments.json"     # legacy JSON store, read if no snapshot yet
+DB_SNAPSHOT_FILE = DATA_DIR / "payments.mp"  # compacted MessagePack snapshot
+DB_LOG_FILE = DATA_DIR / "payments.log"  # append-only, one JSON entry per line
 SETTINGS_FILE = DATA_DIR / "settings.json"
 USERS_FILE = DATA_DIR / "users.json"
 REMINDERS_FILE = DATA_DIR / "reminders.json"
-DB_LOCK = threading.Lock()
+DB_LOCK = threading.Lock()      # serialises payments file I/O across worker threads
+DB_ALOCK = asyncio.Lock()       # held on the loop while a flush/compaction is in flight
+SETTINGS_LOCK = threading.Lock()
+DB_DIRTY = {}             # payment_id -> entry waiting to be logged
+DB_LOG_RECORDS = 0        # lines in payments.log since the last snapshot
+DB_FLUSH_INTERVAL = 0.5   # debounce window after the first change
+DB_COMPACT_EVERY = 1000   # log lines before the snapshot is rewritten
+DB_COMPACT_INTERVAL = 60  # ...or seconds, whichever comes first
+DB_RETRY_DELAY = 5        # back-off after a failed write (full disk, EIO)
+SETTINGS_DIRTY = False    # admin edits wait for the next flush_loop tick
+DB_WAKE = asyncio.Event() # set on every change; flush_loop sleeps on it
 BASE_DIR = Path(__file__).resolve().parent
 ASSETS_DIR = BASE_DIR / "assets"
 ASSETS = {}
 
 def preload_assets():
     try:
-        ASSETS["qr_layout"] = Image.open(
-            ASSETS_DIR / "qr_layout.png"
-        ).convert("RGBA")
+        # the card ends up as JPEG, so drop alpha once here, not per render
+        layout = Image.open(ASSETS_DIR / "qr_layout.png").convert("RGB")
     except Exception as e:
-        print("❌ Failed to load qr_layout.png:", e)
+        log.critical("❌ Failed to load qr_layout.png: %s", e)
         sys.exit(1)
+    layout.load()
+    ASSETS["qr_layout"] = layout
+
+    # ---- FIXED SAFE QR ZONE (matches your layout exactly) ----
+    W, H = layout.size
+    qr_left = int(W * 0.18)
+    qr_top = int(H * 0.22)
+    qr_size = min(int(W * 0.82) - qr_left, int(H * 0.70) - qr_top)
+    ASSETS["qr_box"] = (qr_left, qr_top, qr_size)
 
 preload_assets()
 
@@ -85,64 +132,315 @@ DEFAULT_SETTINGS = {
 RAZORPAY_KEY_ID = os.environ.get("RAZORPAY_KEY_ID", "")
 RAZORPAY_KEY_SECRET = os.environ.get("RAZORPAY_KEY_SECRET", "")
 RAZORPAY_WEBHOOK_SECRET = os.environ.get("RAZORPAY_WEBHOOK_SECRET", "")
+RAZORPAY_API_BASE = "https://api.razorpay.com/v1"
+
+RAZORPAY_AUTH_HEADER = "Basic " + base64.b64encode(
+    f"{RAZORPAY_KEY_ID}:{RAZORPAY_KEY_SECRET}".encode()
+).decode()
+
+# One pooled client for every Razorpay call (keep-alive + HTTP/2),
+# opened in post_init on the running loop and closed in shutdown
+HTTP = None
+
+def make_razorpay_client():
+    return httpx.AsyncClient(
+        base_url=RAZORPAY_API_BASE,
+        timeout=20,
+        # retries only cover failed connects, so a QR is never created twice
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+        ),
+        headers={
+            "Authorization": RAZORPAY_AUTH_HEADER,
+            "Content-Type": "application/json",
+        },
+    )
 
-BOT_LOOP = None
 BOT = None
 
 
+def write_atomic(path, blob, fsync=True):
+    # write a sibling temp file and swap it in, so a crash never leaves a torn file;
+    # fsync=False for small files saved from handlers on the event loop
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(blob)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
 
 def load_users():
     if USERS_FILE.exists():
-        return json.loads(USERS_FILE.read_text())
+        return orjson.loads(USERS_FILE.read_bytes())
     return []
 
 
 def load_reminders():
     if REMINDERS_FILE.exists():
-        return json.loads(REMINDERS_FILE.read_text())
+        return orjson.loads(REMINDERS_FILE.read_bytes())
     return []
 
 def save_reminders(data):
-    REMINDERS_FILE.write_text(json.dumps(data, indent=2))
+    write_atomic(REMINDERS_FILE, orjson.dumps(data, option=orjson.OPT_INDENT_2), fsync=False)
 
 REMINDERS = load_reminders()
 
 
 def save_users(users):
-    USERS_FILE.write_text(json.dumps(users, indent=2))
+    write_atomic(USERS_FILE, orjson.dumps(sorted(users), option=orjson.OPT_INDENT_2), fsync=False)
 
-USERS = list(set(load_users()))
+USERS = set(load_users())
 
 
 def load_db():
+    global DB_LOG_RECORDS
+    db = {"payments": []}
     with DB_LOCK:
-        if DB_FILE.exists():
-            return json.loads(DB_FILE.read_text())
-    return {"payments": []}
+        # an empty snapshot (full disk, crash before fsync) can't be mmapped;
+        # fall through to the legacy JSON / log replay instead
+        if DB_SNAPSHOT_FILE.exists() and DB_SNAPSHOT_FILE.stat().st_size:
+            # decode straight from the page cache, no intermediate bytes copy
+            with open(DB_SNAPSHOT_FILE, "rb") as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                db = msgpack.unpackb(mm)
+        elif DB_FILE.exists():
+            db = orjson.loads(DB_FILE.read_bytes())
+        if DB_LOG_FILE.exists():
+            with open(DB_LOG_FILE, "rb") as f:
+                DB_LOG_RECORDS = replay_log(db, f)
+    # older records carried the full instructions text; it is only needed by
+    # the live countdown, so drop it and let the next compaction shed it
+    for p in db["payments"]:
+        p.pop("caption_text", None)
+    return db
+
+
+def replay_log(db, lines):
+    # every line is the full entry at write time -> last one wins;
+    # streamed one line at a time so the log is never held whole in memory
+    pos = {p["payment_id"]: i for i, p in enumerate(db["payments"])}
+    count = 0
+    for line in lines:
+        try:
+            p = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            continue  # torn tail after a crash mid-append
+        count += 1
+        i = pos.get(p["payment_id"])
+        if i is None:
+            pos[p["payment_id"]] = len(db["payments"])
+            db["payments"].append(p)
+        else:
+            db["payments"][i] = p
+    return count
 
 
 def save_db(db):
+    write_db_bytes(msgpack.packb(db))
+
+
+def write_db_bytes(blob):
+    # full snapshot; callers log the pending batch first, so if we die before
+    # the unlink, replaying payments.log over the new snapshot changes nothing
     with DB_LOCK:
-        DB_FILE.write_text(json.dumps(db, indent=2))
+        write_atomic(DB_SNAPSHOT_FILE, blob)
+        dir_fd = os.open(DATA_DIR, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        DB_LOG_FILE.unlink(missing_ok=True)
+
+
+def append_log_bytes(blob):
+    # one write + one fsync per flush_loop batch, however many entries it holds
+    with DB_LOCK:
+        with open(DB_LOG_FILE, "ab") as f:
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def dirty_log_blob():
+    return b"".join(orjson.dumps(p) + b"\n" for p in DB_DIRTY.values())
+
+
+def mark_dirty(p):
+    # handlers only flag the entry; flush_loop() appends it to payments.log
+    DB_DIRTY[p["payment_id"]] = p
+    DB_WAKE.set()
+
+
+def mark_settings_dirty():
+    # several /setprice, /setlink ... in a row collapse into one write
+    global SETTINGS_DIRTY
+    SETTINGS_DIRTY = True
+    DB_WAKE.set()
+    build_manual_payment_text.cache_clear()
+
+
+def flush_now():
+    # synchronous final flush (post_shutdown, atexit)
+    global SETTINGS_DIRTY, DB_LOG_RECORDS
+    if SETTINGS_DIRTY:
+        SETTINGS_DIRTY = False
+        save_settings(SETTINGS)
+    if DB_DIRTY or DB_LOG_RECORDS:
+        if DB_DIRTY:
+            append_log_bytes(dirty_log_blob())
+        DB_DIRTY.clear()
+        DB_LOG_RECORDS = 0
+        save_db(DB)
+
 
+async def persist_now(p):
+    # bypass the debounce: p is in payments.log (fsynced) when this returns
+    global DB_LOG_RECORDS
+    async with DB_ALOCK:
+        blob = orjson.dumps(p) + b"\n"
+        DB_DIRTY.pop(p["payment_id"], None)
+        try:
+            await asyncio.to_thread(append_log_bytes, blob)
+        except Exception:
+            mark_dirty(p)  # leave it to flush_loop's retry
+            raise
+        DB_LOG_RECORDS += 1
+
+
+async def flush_loop():
+    global DB_LOG_RECORDS, SETTINGS_DIRTY
+    last_snapshot = time.monotonic()
+    while True:
+        # idle until something changes, then let the burst pile up
+        await DB_WAKE.wait()
+        await asyncio.sleep(DB_FLUSH_INTERVAL)
+        DB_WAKE.clear()
+        if not DB_DIRTY and not SETTINGS_DIRTY:
+            continue
+
+        # encode on the loop (consistent view), write off the loop
+        failed = False
+        async with DB_ALOCK:
+            if SETTINGS_DIRTY:
+                SETTINGS_DIRTY = False
+                blob = orjson.dumps(SETTINGS, option=orjson.OPT_INDENT_2)
+                try:
+                    await asyncio.to_thread(write_settings_bytes, blob)
+                except Exception:
+                    log.exception("Settings flush failed, will retry")
+                    SETTINGS_DIRTY = failed = True
+
+            if DB_DIRTY:
+                batch = dict(DB_DIRTY)
+                compact = (
+                    DB_LOG_RECORDS + len(batch) >= DB_COMPACT_EVERY
+                    or time.monotonic() - last_snapshot >= DB_COMPACT_INTERVAL
+                )
+                log_blob = dirty_log_blob()
+                snapshot = msgpack.packb(DB) if compact else None
+                DB_DIRTY.clear()
+                try:
+                    await asyncio.to_thread(append_log_bytes, log_blob)
+                    DB_LOG_RECORDS += len(batch)
+                    if compact:
+                        await asyncio.to_thread(write_db_bytes, snapshot)
+                        DB_LOG_RECORDS = 0
+                        last_snapshot = time.monotonic()
+                except Exception:
+                    log.exception("Payments flush failed, will retry")
+                    # entries re-flagged meanwhile are the same dicts; keep them
+                    for pid, p in batch.items():
+                        DB_DIRTY.setdefault(pid, p)
+                    failed = True
+
+        if failed:
+            DB_WAKE.set()
+            await asyncio.sleep(DB_RETRY_DELAY)
 
 def load_settings():
-    if SETTINGS_FILE.exists(): return json.loads(SETTINGS_FILE.read_text())
-    SETTINGS_FILE.write_text(json.dumps(DEFAULT_SETTINGS, indent=2))
+    if SETTINGS_FILE.exists(): return orjson.loads(SETTINGS_FILE.read_bytes())
+    save_settings(DEFAULT_SETTINGS)
     return DEFAULT_SETTINGS
 
 def now_ms():
     return int(time.perf_counter() * 1000)
 
 def save_settings(s):
-    SETTINGS_FILE.write_text(json.dumps(s, indent=2))
+    write_settings_bytes(orjson.dumps(s, option=orjson.OPT_INDENT_2))
+
+def write_settings_bytes(blob):
+    with SETTINGS_LOCK:
+        write_atomic(SETTINGS_FILE, blob)
 
 DB = load_db()
+if DB_LOG_FILE.exists() or not DB_SNAPSHOT_FILE.exists() or not DB_SNAPSHOT_FILE.stat().st_size:
+    # fold the replayed log (and any torn tail, even with no whole lines)
+    # into a fresh snapshot so this run starts appending to an empty payments.log
+    save_db(DB)
+    DB_LOG_RECORDS = 0
 SETTINGS = load_settings()
+atexit.register(flush_now)  # last resort if the loop dies before post_shutdown
+ADMIN_ID = SETTINGS["admin_chat_id"]  # no command changes it at runtime
+
+# O(1) lookups; values alias the dicts inside DB["payments"]
+PAY_INDEX = {p["payment_id"]: p for p in DB["payments"]}
+QR_INDEX = {p["razorpay_qr_id"]: p for p in DB["payments"] if p.get("razorpay_qr_id")}
+USER_PAYMENTS = {}  # user_id -> that user's entries, oldest first
+for p in DB["payments"]:
+    USER_PAYMENTS.setdefault(p["user_id"], []).append(p)
+STATUS_COUNTS = Counter(p["status"] for p in DB["payments"])  # feeds /stats
+PENDING = {p["payment_id"]: p for p in DB["payments"] if p["status"] == "pending"}
+VERIFIED_BY_PACKAGE = Counter(p["package"] for p in DB["payments"] if p["status"] == "verified")
+BUYER_IDS = {p["user_id"] for p in DB["payments"] if p["status"] == "verified"}
+
+
+def add_payment(entry):
+    if entry["payment_id"] in PAY_INDEX:
+        raise ValueError(f"duplicate payment_id {entry['payment_id']}")
+    DB["payments"].append(entry)
+    PAY_INDEX[entry["payment_id"]] = entry
+    USER_PAYMENTS.setdefault(entry["user_id"], []).append(entry)
+    STATUS_COUNTS[entry["status"]] += 1
+    if entry["status"] == "pending":
+        PENDING[entry["payment_id"]] = entry
+    elif entry["status"] == "verified":
+        VERIFIED_BY_PACKAGE[entry["package"]] += 1
+        BUYER_IDS.add(entry["user_id"])
+    if entry.get("razorpay_qr_id"):
+        QR_INDEX[entry["razorpay_qr_id"]] = entry
+
+def set_status(p, status):
+    # every status change goes through here so the counters/PENDING stay exact
+    STATUS_COUNTS[p["status"]] -= 1
+    if p["status"] == "verified":
+        VERIFIED_BY_PACKAGE[p["package"]] -= 1
+    if status == "verified":
+        VERIFIED_BY_PACKAGE[p["package"]] += 1
+    STATUS_COUNTS[status] += 1
+    if status == "pending":
+        PENDING[p["payment_id"]] = p
+    else:
+        PENDING.pop(p["payment_id"], None)
+    p["status"] = status
+    if status == "verified":
+        BUYER_IDS.add(p["user_id"])
+    elif not any(q["status"] == "verified" for q in USER_PAYMENTS.get(p["user_id"], ())):
+        BUYER_IDS.discard(p["user_id"])
+
+def verified_income():
+    # priced at today's UPI rates, like the per-payment loop it replaces
+    prices = SETTINGS["prices"]
+    return sum(
+        (prices.get(pkg, {}).get("upi") or 0) * n
+        for pkg, n in VERIFIED_BY_PACKAGE.items()
+    )
 
 # -------------------- Razorpay Smart QR Helper --------------------
-def create_razorpay_smart_qr(amount_in_rupees, user_id, package):
-    url = "https://api.razorpay.com/v1/payments/qr_codes"
+async def create_razorpay_smart_qr(amount_in_rupees, user_id, package):
     payload = {
         "type": "upi_qr",
         "name": f"User_{user_id}",
@@ -156,55 +454,79 @@ def create_razorpay_smart_qr(amount_in_rupees, user_id, package):
         }
     }
     try:
-        r = requests.post(url, auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET), json=payload, timeout=20)
+        r = await HTTP.post("/payments/qr_codes", json=payload)
         r.raise_for_status()
         return r.json()
     except Exception as e:
-        print(f"QR Error: {e}")
+        log.error("QR Error: %s", e)
         return None
 
+# Double-taps within a few seconds reuse the QR Razorpay just created
+QR_CACHE = {}  # (user_id, package, amount) -> (qr_resp, expires_at)
+QR_CACHE_TTL = 5
+
+async def get_smart_qr(amount_in_rupees, user_id, package):
+    now = time.monotonic()
+    for key in [k for k, (_, exp) in QR_CACHE.items() if exp <= now]:
+        del QR_CACHE[key]
+
+    key = (user_id, package, amount_in_rupees)
+    hit = QR_CACHE.get(key)
+    if hit:
+        return hit[0]
+
+    qr_resp = await create_razorpay_smart_qr(amount_in_rupees, user_id, package)
+    if qr_resp and "id" in qr_resp:
+        QR_CACHE[key] = (qr_resp, now + QR_CACHE_TTL)
+    return qr_resp
+
 
 def rounded_rect(draw, xy, radius, fill):
     x1, y1, x2, y2 = xy
     draw.rounded_rectangle(xy, radius=radius, fill=fill)
 
-def make_upi_qr_card_fast(upi_intent: str) -> BytesIO:
-    base = ASSETS["qr_layout"].copy()
-    W, H = base.size
-
-    # ---- FIXED SAFE QR ZONE (matches your layout exactly) ----
-    QR_LEFT   = int(W * 0.18)
-    QR_TOP    = int(H * 0.22)
-    QR_RIGHT  = int(W * 0.82)
-    QR_BOTTOM = int(H * 0.70)
-
-    QR_SIZE = min(QR_RIGHT - QR_LEFT, QR_BOTTOM - QR_TOP)
-
-    qr = qrcode.QRCode(
-        version=None,  # ✅ auto
-        error_correction=qrcode.constants.ERROR_CORRECT_M,
-        box_size=6,
-        border=2
+@lru_cache(maxsize=32)
+def encode_upi_qr(upi_intent: str) -> Image.Image:
+    # 1 px per module straight from the matrix (no PNG encode/decode);
+    # the card scales it up with NEAREST
+    qr = segno.make_qr(upi_intent, error="m")
+    size = qr.symbol_size(scale=1, border=2)
+    pixels = bytes(
+        0 if dark else 255
+        for row in qr.matrix_iter(scale=1, border=2)
+        for dark in row
     )
-    qr.add_data(upi_intent)
-    qr.make(fit=True)  # ✅ FIX
+    return Image.frombytes("L", size, pixels)
 
-    qr_img = qr.make_image(
-        fill_color="black",
-        back_color="white"
-    ).convert("RGB")
+# QR renders get their own workers so a burst of UPI taps can't starve the
+# default executor used for file writes (asyncio.to_thread)
+PIL_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pil")
 
-    qr_img = qr_img.resize((QR_SIZE, QR_SIZE), Image.NEAREST)
-    base.paste(qr_img, (QR_LEFT, QR_TOP))
+def make_upi_qr_card_fast(upi_intent: str) -> bytes:
+    base = ASSETS["qr_layout"].copy()
+    qr_left, qr_top, qr_size = ASSETS["qr_box"]
+
+    qr_img = encode_upi_qr(upi_intent).resize((qr_size, qr_size), Image.NEAREST)
+    base.paste(qr_img, (qr_left, qr_top))
 
     bio = BytesIO()
-    base = base.convert("RGB")   # remove alpha
     base.save(bio, "JPEG", quality=88, subsampling=1)
-
-    bio.seek(0)
-    return bio
+    return bio.getvalue()
 
 # -------------------- Bot Handlers --------------------
+_DAY_START = 0
+_NEXT_DAY_START = 0
+
+def today_start():
+    # local midnight; only recomputed once the day rolls over
+    global _DAY_START, _NEXT_DAY_START
+    now = time.time()
+    if now >= _NEXT_DAY_START:
+        t = time.localtime(now)
+        _DAY_START = int(time.mktime(t[:3] + (0, 0, 0, 0, 0, -1)))
+        _NEXT_DAY_START = int(time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 1, 0, 0, 0, 0, 0, -1)))
+    return _DAY_START
+
 def conversion_stats(days=None):
     """
     days = None  -> all time
@@ -212,7 +534,12 @@ def conversion_stats(days=None):
     days = 7     -> last 7 days
     days = 30    -> last 30 days
     """
-    now = int(time.time())
+    if days is None:
+        cutoff = None
+    elif days == 0:
+        cutoff = today_start()
+    else:
+        cutoff = int(time.time()) - days * 86400
 
     def in_range(p):
         if p["status"] != "verified":
@@ -220,13 +547,9 @@ def conversion_stats(days=None):
         # ✅ COUNT ONLY REMINDER-BASED PURCHASES
         if not p.get("from_reminder"):
             return False      
-        if days is None:
+        if cutoff is None:
             return True
-        if days == 0:
-            today_start = int(time.mktime(time.localtime()[:3] + (0, 0, 0, 0, 0, -1)))
-            return p["created_at"] >= today_start
-
-        return p["created_at"] >= now - days * 86400
+        return p["created_at"] >= cutoff
 
     stats = {
         "upi": {"vip": 0, "dark": 0, "both": 0},
@@ -251,38 +574,102 @@ def clear_user_reminders(user_id):
     save_reminders(REMINDERS)
 
 def get_buyer_ids():
-    return {p["user_id"] for p in DB["payments"] if p["status"] == "verified"}
+    return BUYER_IDS
 
 def get_nonbuyer_ids():
-    buyers = get_buyer_ids()
-    return {uid for uid in USERS if uid not in buyers}
+    return USERS - BUYER_IDS
 
-app = Flask(__name__)
 TELEGRAM_TOKEN = os.environ.get("BOT_TOKEN")
 
-def back_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("⬅️ Back", callback_data="back_packages")]
-    ])
+# Static reply texts
+HELP_TEXT = (
+    "🆘 Need help?\n\n"
+    "If payment failed or you're stuck,\n\n"
+    "contact support here 👇\n"
+    "👉 @Dark123222_bot"
+)
+UNDER_REVIEW_TEXT = (
+    "⏳ **Payment Under Review**\n\n"
+    "Your payment proof is received.\n"
+    "Admin is verifying it — please wait.\n\n"
+    "You’ll get access automatically once approved ✅"
+)
+NO_PAYMENT_TEXT = "❌ No payment found.\nStart with /start"
+
+# /stats and the admin panel's Stats button; filled with .format(**counts)
+STATS_TEXT = (
+    "📊 <b>BOT SALES STATISTICS</b>\n\n"
+    "👥 <b>Total Users Started Bot:</b> {users}\n\n"
+    "✅ Verified Payments: <b>{verified}</b>\n"
+    "🟡 Pending Payments: <b>{pending}</b>\n"
+    "⛔ Declined: <b>{declined}</b>\n"
+    "⌛ Expired: <b>{expired}</b>\n\n"
+    "💰 <b>Total Income:</b> ₹{income}\n"
+    "———————————————\n"
+    "Use /pending to view open payments."
+)
+STATS_BUTTON_TEXT = (
+    "📊 <b>BOT SALES STATISTICS</b>\n\n"
+    "👥 Users: {users}\n"
+    "✅ Sales: {verified}\n"
+    "🟡 Pending: {pending}\n"
+    "⛔ Declined: {declined}\n"
+    "⌛ Expired: {expired}\n\n"
+    "💰 Income: ₹{income}"
+)
 
 
-def main_keyboard():
-    kb = [
-        [InlineKeyboardButton("🔥 VIP", callback_data="choose_vip")],
-        [InlineKeyboardButton("🌑 DARK", callback_data="choose_dark")],
-        [InlineKeyboardButton("💥 BOTH (30% off)", callback_data="choose_both")],
-        [InlineKeyboardButton("📊 Check Payment Status", callback_data="status_btn")],
-        [InlineKeyboardButton("🆘 HELP", callback_data="help")],
-    ]
-    return InlineKeyboardMarkup(kb)
+def stats_counts():
+    return {
+        "users": len(USERS),
+        "verified": STATUS_COUNTS["verified"],
+        "pending": STATUS_COUNTS["pending"],
+        "declined": STATUS_COUNTS["declined"],
+        "expired": STATUS_COUNTS["expired"],
+        "income": verified_income(),
+    }
+
+BACK_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⬅️ Back", callback_data="back_packages")]
+])
+
+
+# Static -> built once and shared by /start and the "Back" button
+MAIN_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔥 VIP", callback_data="choose_vip")],
+    [InlineKeyboardButton("🌑 DARK", callback_data="choose_dark")],
+    [InlineKeyboardButton("💥 BOTH (30% off)", callback_data="choose_both")],
+    [InlineKeyboardButton("📊 Check Payment Status", callback_data="status_btn")],
+    [InlineKeyboardButton("🆘 HELP", callback_data="help")],
+])
+
+
+# Payment-method keyboards only depend on prices -> rebuilt on /setprice
+PKG_KB = {}
+
+def build_package_keyboards():
+    for package, prices in SETTINGS["prices"].items():
+        PKG_KB[package] = InlineKeyboardMarkup([
+            [InlineKeyboardButton(f"💸 UPI (Fast/Auto) - ₹{prices['upi']}",
+                                  callback_data=f"pay_upi:{package}")],
+            [InlineKeyboardButton(f"🪙 Crypto - ${prices['crypto_usd']}",
+                                  callback_data=f"pay_crypto:{package}")],
+            [InlineKeyboardButton(f"🌍 Remitly - ₹{prices['remitly']}",
+                                  callback_data=f"pay_remitly:{package}")],
+            [
+                InlineKeyboardButton("⬅️ Back", callback_data="back_packages"),
+                InlineKeyboardButton("❌ Cancel", callback_data="cancel")
+            ],
+        ])
+
+build_package_keyboards()
 
     
 async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
     if user.id not in USERS:
-        USERS.append(user.id)
-        USERS[:] = list(set(USERS))
+        USERS.add(user.id)
         save_users(USERS)
 
 
@@ -302,11 +689,11 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text(
         text,
-        reply_markup=main_keyboard(),
+        reply_markup=MAIN_KB,
     )
 async def cleanup_previous_pending_payments(user_id, context):
-    for p in DB["payments"]:
-        if p["user_id"] == user_id and p["status"] == "pending":
+    for p in USER_PAYMENTS.get(user_id, ()):
+        if p["status"] == "pending":
 
             # stop countdown
             task = COUNTDOWN_TASKS.get(p["payment_id"])
@@ -321,7 +708,7 @@ async def cleanup_previous_pending_payments(user_id, context):
                         p["chat_id"], p["message_id"]
                     )
             except Exception as e:
-                print("Ignored error:", e)
+                log.warning("Ignored error: %s", e)
 
 
             # delete loading messages
@@ -329,12 +716,12 @@ async def cleanup_previous_pending_payments(user_id, context):
                 for mid in p.get("loading_msg_ids", []):
                     await context.bot.delete_message(user_id, mid)
             except Exception as e:
-                print("Ignored error:", e)
+                log.warning("Ignored error: %s", e)
 
             # expire payment
-            p["status"] = "expired"
+            set_status(p, "expired")
+            mark_dirty(p)
             break
-    save_db(DB)
     
 async def handle_payment(method, package, query, context, from_reminder=False):
     user = query.from_user
@@ -343,7 +730,7 @@ async def handle_payment(method, package, query, context, from_reminder=False):
     await cleanup_previous_pending_payments(user.id, context)
 
     entry = {
-        "payment_id": f"p_{int(time.time()*1000)}",
+        "payment_id": f"p_{uuid.uuid4().hex}",  # unique across concurrent updates
         "user_id": user.id,
         "username": user.username or "",
         "package": package,
@@ -368,24 +755,16 @@ async def handle_payment(method, package, query, context, from_reminder=False):
             f"• No screenshots needed\n"
             f"• Stay on this screen until payment completes ⏳"
         )
-        loop = asyncio.get_running_loop()
         t0 = now_ms()
-        print(f"[TIMING] total_start               +0 ms")
+        log.debug("[TIMING] total_start               +0 ms")
 
         # 1️⃣ Razorpay QR creation
         t1 = now_ms()
-        qr_resp = await loop.run_in_executor(
-            None,
-            create_razorpay_smart_qr,
-            amount,
-            user.id,
-            package
-        )
+        qr_resp = await get_smart_qr(amount, user.id, package)
         # ✅ SAFETY CHECK (THIS IS WHERE IT GOES)
         if not qr_resp or "id" not in qr_resp:
-            if entry not in DB["payments"]:
-                DB["payments"].append(entry)
-            save_db(DB)
+            add_payment(entry)
+            mark_dirty(entry)
 
 
             await query.message.reply_text(
@@ -394,30 +773,28 @@ async def handle_payment(method, package, query, context, from_reminder=False):
             return
 
         t2 = now_ms()
-        print(f"[TIMING] razorpay_qr_created       +{t2 - t1} ms")
+        log.debug("[TIMING] razorpay_qr_created       +%d ms", t2 - t1)
         upi_link = qr_resp.get("image_content")
         if not upi_link:
             entry["status"] = "expired"
-            if entry not in DB["payments"]:
-                DB["payments"].append(entry)
-            save_db(DB)
+            add_payment(entry)
+            mark_dirty(entry)
 
             await query.message.reply_text("❌ Failed to generate UPI intent. Try again.")
             return
         
-        # 3️⃣ QR crop
+        # 3️⃣ QR render
         t5 = now_ms()
-        # 🧠 mandatory crop (executor)
-        loop = asyncio.get_running_loop()
+        # 🧠 CPU-bound render -> PIL pool, loop stays free
         try:
-            qr_bytes = await loop.run_in_executor(
-                None,
+            qr_bytes = await asyncio.get_running_loop().run_in_executor(
+                PIL_POOL,
                 make_upi_qr_card_fast,
                 qr_resp["image_content"]
             )
 
         except Exception as e:
-            print("QR render error:", e)
+            log.error("QR render error: %s", e)
             await query.message.reply_text(
                 "❌ QR rendering failed. Please try again."
             )
@@ -425,7 +802,7 @@ async def handle_payment(method, package, query, context, from_reminder=False):
 
 
         t6 = now_ms()
-        print(f"[TIMING] qr_image_cropped          +{t6 - t5} ms")
+        log.debug("[TIMING] qr_image_rendered         +%d ms", t6 - t5)
         
         # 4️⃣ Telegram upload
         t7 = now_ms()
@@ -446,19 +823,16 @@ async def handle_payment(method, package, query, context, from_reminder=False):
 
 
         t8 = now_ms()
-        print(f"[TIMING] telegram_photo_sent       +{t8 - t7} ms")
+        log.debug("[TIMING] telegram_photo_sent       +%d ms", t8 - t7)
 
-        print(
-            f"[TIMING][user={user.id}][{package}] TOTAL = {t8 - t0} ms"
-        )
+        log.debug("[TIMING][user=%s][%s] TOTAL = %d ms", user.id, package, t8 - t0)
 
 
         entry["razorpay_qr_id"] = qr_resp["id"]   # REQUIRED for webhook match
-        DB["payments"].append(entry) 
-        save_db(DB) 
-        entry["caption_text"] = caption_text
+        add_payment(entry)
         entry["chat_id"] = qr_msg.chat.id
         entry["message_id"] = qr_msg.message_id
+        mark_dirty(entry)
         
 
         old = COUNTDOWN_TASKS.pop(entry["payment_id"], None)
@@ -466,225 +840,223 @@ async def handle_payment(method, package, query, context, from_reminder=False):
             old.cancel()
 
         COUNTDOWN_TASKS[entry["payment_id"]] = asyncio.create_task(
-            start_countdown(entry["payment_id"], qr_msg.chat.id, qr_msg.message_id, 600)
+            start_countdown(entry["payment_id"], qr_msg.chat.id, qr_msg.message_id, caption_text, 600)
         )
 
         return
 
     # ---------- MANUAL ----------
-    if entry not in DB["payments"]:
-        DB["payments"].append(entry)
-    save_db(DB)
+    add_payment(entry)
+    mark_dirty(entry)
 
 
     caption_text = build_manual_payment_text(package, method)
 
     msg = await query.message.reply_text(caption_text, parse_mode="Markdown")
-    entry["caption_text"] = caption_text
     entry["chat_id"] = msg.chat.id
     entry["message_id"] = msg.message_id
-    save_db(DB)
+    mark_dirty(entry)
 
     old = COUNTDOWN_TASKS.pop(entry["payment_id"], None)
     if old:
         old.cancel()
 
     COUNTDOWN_TASKS[entry["payment_id"]] = asyncio.create_task(
-        start_countdown(entry["payment_id"], msg.chat.id, msg.message_id, 1800)
+        start_countdown(entry["payment_id"], msg.chat.id, msg.message_id, caption_text, 1800)
     )
 
 
     return
 
+# choose_vip | pay_upi:vip | reminder_pay_crypto:dark | cancel | help | ...
+CB_RE = re.compile(
+    r"^(?P<act>back_packages|help|status_btn|cancel|choose|pay|reminder_pay)"
+    r"(?:_(?P<method>upi|crypto|remitly)(?=:))?"
+    r"(?:[_:](?P<package>\w+))?$"
+)
+
+
+# Updates run concurrently; one user's taps/uploads still run one at a time
+USER_LOCKS = weakref.WeakValueDictionary()  # a lock lives only while someone holds/awaits it
+
+def user_lock(user_id):
+    lock = USER_LOCKS.get(user_id)
+    if lock is None:
+        lock = USER_LOCKS[user_id] = asyncio.Lock()
+    return lock
+
+
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    data = query.data
-    user = query.from_user
-    
-    
-    # ----- BACK TO PACKAGES -----
-    if data == "back_packages":
-        clear_user_reminders(user.id)
-        await cleanup_previous_pending_payments(user.id, context)
-
-        await query.message.edit_text(
-            f"👋 Welcome {user.first_name or 'there'}\n\n"
-            "🔐 Secure & Instant Access Bot.\n\n"
-            "🧾 How it works:\n"
-            "1️⃣ Choose a package\n"
-            "2️⃣ Pay via UPI / Crypto / Remitly\n"
-            "3️⃣ Get instant access (UPI)\n\n"
-            "👇 Select a package to continue",
-            reply_markup=main_keyboard(),
-            parse_mode="Markdown"
-        )
-        return
 
+    m = CB_RE.match(query.data)
+    if not m:
+        return
+    async with user_lock(query.from_user.id):
+        return await CB_HANDLERS[m["act"]](update, context, query, query.from_user, m)
 
-    
-    # ----- HELP -----
-    if data == "help":
-        try:
-            await query.message.edit_text(
-                "🆘 Need help?\n\n"
-                "If payment failed or you're stuck,\n\n"
-                "contact support here 👇\n"
-                "👉 @Dark123222_bot",
-                reply_markup=back_keyboard()
-            )
-        except Exception:
-            pass
 
-        return
+# ----- BACK TO PACKAGES -----
+async def cb_back_packages(update, context, query, user, m):
+    clear_user_reminders(user.id)
+    await cleanup_previous_pending_payments(user.id, context)
 
+    await query.message.edit_text(
+        f"👋 Welcome {user.first_name or 'there'}\n\n"
+        "🔐 Secure & Instant Access Bot.\n\n"
+        "🧾 How it works:\n"
+        "1️⃣ Choose a package\n"
+        "2️⃣ Pay via UPI / Crypto / Remitly\n"
+        "3️⃣ Get instant access (UPI)\n\n"
+        "👇 Select a package to continue",
+        reply_markup=MAIN_KB,
+        parse_mode="Markdown"
+    )
 
-    # ----- STATUS BUTTON -----
-    if data == "status_btn":
-        return await status_handler(update, context)
 
+# ----- HELP -----
+async def cb_help(update, context, query, user, m):
+    try:
+        await query.message.edit_text(HELP_TEXT, reply_markup=BACK_KB)
+    except Exception:
+        pass
 
 
+# ----- STATUS BUTTON -----
+async def cb_status(update, context, query, user, m):
+    return await status_handler(update, context)
 
-    # ----- PACKAGE SELECTION -----
-    if data.startswith("choose_"):
-        # 🔥 CLEAN OLD PENDING PAYMENTS WHEN SWITCHING PACKAGE
-        await cleanup_previous_pending_payments(user.id, context)
 
-        # 🚫 BLOCK IF USER ALREADY PAID FOR THIS PACKAGE
-        package = data.split("_")[1]
+# ----- PACKAGE SELECTION -----
+async def cb_choose(update, context, query, user, m):
+    # 🔥 CLEAN OLD PENDING PAYMENTS WHEN SWITCHING PACKAGE
+    await cleanup_previous_pending_payments(user.id, context)
 
-        if any(
-            p["user_id"] == user.id and
-            p["package"] == package and
-            p["status"] == "verified"
-            for p in DB["payments"]
-        ):
-            # ✅ SAFE to clear reminders here
-            clear_user_reminders(user.id)
-  
-            await send_link_to_user(user.id, package)
-            return
+    # 🚫 BLOCK IF USER ALREADY PAID FOR THIS PACKAGE
+    package = m["package"]
 
-        
+    if any(
+        p["package"] == package and
+        p["status"] == "verified"
+        for p in USER_PAYMENTS.get(user.id, ())
+    ):
+        # ✅ SAFE to clear reminders here
         clear_user_reminders(user.id)
-        REMINDERS.append({
-            "user_id": user.id,
-            "package": data.split("_")[1],
-            "intent": "package_clicked",
-            "created_at": int(time.time()),
-            "sent": [],
-            "touched": False,   # ✅ ADD THIS
-            "clicked_from_reminder": False
-        })
-        save_reminders(REMINDERS)
-
-        package = data.split("_")[1]
-        kb = [
-            [InlineKeyboardButton(f"💸 UPI (Fast/Auto) - ₹{SETTINGS['prices'][package]['upi']}",
-                                  callback_data=f"pay_upi:{package}")],
-            [InlineKeyboardButton(f"🪙 Crypto - ${SETTINGS['prices'][package]['crypto_usd']}",
-                                  callback_data=f"pay_crypto:{package}")],
-            [InlineKeyboardButton(f"🌍 Remitly - ₹{SETTINGS['prices'][package]['remitly']}",
-                                  callback_data=f"pay_remitly:{package}")],
-            [
-                InlineKeyboardButton("⬅️ Back", callback_data="back_packages"),
-                InlineKeyboardButton("❌ Cancel", callback_data="cancel")
-             
-            ],
-        ]
-        await query.message.edit_text(
-            f"💳 **Choose Payment Method for {package.upper()}**\n\n"
-            "⚡ UPI → Instant & Auto-Approved\n"
-            "🕒 Crypto / Remitly → Manual verification\n",
-            reply_markup=InlineKeyboardMarkup(kb),
-            parse_mode="Markdown"
-        )
+
+        await send_link_to_user(user.id, package)
         return
 
-    # ----- CANCEL -----
-    if data == "cancel":
-        clear_user_reminders(user.id)
-        # stop countdowns & clean messages
-        for p in DB["payments"]:
-            if p["user_id"] == user.id and p["status"] == "pending":
-            
-                # stop countdown
-                task = COUNTDOWN_TASKS.get(p["payment_id"])
-                if task:
-                    task.cancel()
-                    COUNTDOWN_TASKS.pop(p["payment_id"], None)
+    
+    clear_user_reminders(user.id)
+    REMINDERS.append({
+        "user_id": user.id,
+        "package": package,
+        "intent": "package_clicked",
+        "created_at": int(time.time()),
+        "sent": [],
+        "touched": False,   # ✅ ADD THIS
+        "clicked_from_reminder": False
+    })
+    save_reminders(REMINDERS)
 
-                # delete payment message (QR or manual)
-                try:
-                    if p.get("chat_id") and p.get("message_id"):
-                        await context.bot.delete_message(
-                            p["chat_id"], p["message_id"]
-                        )
-                except:
-                    pass
-                # delete loading messages (Creating QR / Sending QR)
-                try:
-                    for mid in p.get("loading_msg_ids", []):
-                        await context.bot.delete_message(user.id, mid)
-                except:
-                    pass
+    await query.message.edit_text(
+        f"💳 **Choose Payment Method for {package.upper()}**\n\n"
+        "⚡ UPI → Instant & Auto-Approved\n"
+        "🕒 Crypto / Remitly → Manual verification\n",
+        reply_markup=PKG_KB[package],
+        parse_mode="Markdown"
+    )
 
 
-                # mark payment as cancelled
-                p["status"] = "expired"
+# ----- CANCEL -----
+async def cb_cancel(update, context, query, user, m):
+    clear_user_reminders(user.id)
+    # stop countdowns & clean messages
+    for p in USER_PAYMENTS.get(user.id, ()):
+        if p["status"] == "pending":
+        
+            # stop countdown
+            task = COUNTDOWN_TASKS.get(p["payment_id"])
+            if task:
+                task.cancel()
+                COUNTDOWN_TASKS.pop(p["payment_id"], None)
 
-        save_db(DB)
+            # delete payment message (QR or manual)
+            try:
+                if p.get("chat_id") and p.get("message_id"):
+                    await context.bot.delete_message(
+                        p["chat_id"], p["message_id"]
+                    )
+            except:
+                pass
+            # delete loading messages (Creating QR / Sending QR)
+            try:
+                for mid in p.get("loading_msg_ids", []):
+                    await context.bot.delete_message(user.id, mid)
+            except:
+                pass
 
-        await query.message.edit_text(
-            "❌ Payment cancelled.\n\n"
-            "No worries 🙂\n"
-            "You can restart anytime using /start"
-        )
-        return
 
+            # mark payment as cancelled
+            set_status(p, "expired")
+            mark_dirty(p)
 
-    
-    # ----- REMINDER PAYMENT BUTTON -----
-    if data.startswith("reminder_pay_"):
-        part, package = data.split(":")
-        method = part.replace("reminder_pay_", "")
-
-        for r in REMINDERS:
-            if r["user_id"] == user.id:
-                r["clicked_from_reminder"] = True
-                r["intent"] = "upi_clicked" if method == "upi" else "manual_clicked"
-                save_reminders(REMINDERS)
-                break
-
-        return await handle_payment(
-            method=method,
-            package=package,
-            query=query,
-            context=context,
-            from_reminder=True
-        )
 
+    await query.message.edit_text(
+        "❌ Payment cancelled.\n\n"
+        "No worries 🙂\n"
+        "You can restart anytime using /start"
+    )
 
-    # ----- PAYMENT METHOD SELECTED -----
-    if data.startswith("pay_"):
-        method, package = data.split(":")
-        method = method.replace("pay_", "")
-        for r in REMINDERS:
-            if r["user_id"] == user.id:
-                r["intent"] = "upi_clicked" if method == "upi" else "manual_clicked"
-                save_reminders(REMINDERS)
-                break
-
-        return await handle_payment(
-            method=method,
-            package=package,
-            query=query,
-            context=context,
-            from_reminder=False
-        )
 
+# ----- REMINDER PAYMENT BUTTON -----
+async def cb_reminder_pay(update, context, query, user, m):
+    method = m["method"]
 
+    for r in REMINDERS:
+        if r["user_id"] == user.id:
+            r["clicked_from_reminder"] = True
+            r["intent"] = "upi_clicked" if method == "upi" else "manual_clicked"
+            save_reminders(REMINDERS)
+            break
+
+    return await handle_payment(
+        method=method,
+        package=m["package"],
+        query=query,
+        context=context,
+        from_reminder=True
+    )
+
+
+# ----- PAYMENT METHOD SELECTED -----
+async def cb_pay(update, context, query, user, m):
+    method = m["method"]
+    for r in REMINDERS:
+        if r["user_id"] == user.id:
+            r["intent"] = "upi_clicked" if method == "upi" else "manual_clicked"
+            save_reminders(REMINDERS)
+            break
+
+    return await handle_payment(
+        method=method,
+        package=m["package"],
+        query=query,
+        context=context,
+        from_reminder=False
+    )
+
+
+CB_HANDLERS = {
+    "back_packages": cb_back_packages,
+    "help": cb_help,
+    "status_btn": cb_status,
+    "choose": cb_choose,
+    "cancel": cb_cancel,
+    "reminder_pay": cb_reminder_pay,
+    "pay": cb_pay,
+}
 
 
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -693,83 +1065,97 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # USER SENT PHOTO OR DOCUMENT
     if msg.photo or msg.document:
+        async with user_lock(user_id):
+            for p in reversed(USER_PAYMENTS.get(user_id, ())):
+
+                if p["status"] == "pending" and p["method"] in ("crypto", "remitly"):
+
+                    # -------- DELETE OLD PAYMENT INSTRUCTION MESSAGE ----------
+                    try:
+                        old_chat = p.get("chat_id")
+                        old_msg = p.get("message_id")
+                        if old_chat and old_msg:
+                            await context.bot.delete_message(old_chat, old_msg)
+                    except Exception as e:
+                        log.warning("Failed to delete old instruction message: %s", e)
+
+                    # -------- STOP COUNTDOWN ----------
+                    task = COUNTDOWN_TASKS.get(p["payment_id"])
+                    if task:
+                        task.cancel()
+                        COUNTDOWN_TASKS.pop(p["payment_id"], None)
+
+                    # -------- UPDATE STATUS TO UNDER REVIEW ----------
+                    set_status(p, "review")
+                    mark_dirty(p)
+
+                    # -------- SAVE PROOF FILE ----------
+                    file_obj = msg.photo[-1] if msg.photo else msg.document
+                    file = await file_obj.get_file()
+                    save_path = DATA_DIR / f"proof_{user_id}_{int(time.time())}.jpg"
+                    data = bytes(await file.download_as_bytearray())
+                    await asyncio.to_thread(save_path.write_bytes, data)
+                    p.setdefault("proof_files", []).append(str(save_path))
+                    mark_dirty(p)
+
+                    # -------- FORWARD TO ADMIN ----------
+                    buttons = InlineKeyboardMarkup([
+                        [
+                            InlineKeyboardButton("✅ APPROVE", callback_data=f"approve:{p['payment_id']}"),
+                            InlineKeyboardButton("❌ DECLINE", callback_data=f"decline:{p['payment_id']}")
+                        ]
+                    ])
 
-        for p in reversed(DB["payments"]):
-
-            if p["user_id"] == user_id and p["status"] == "pending" and p["method"] in ("crypto", "remitly"):
-
-                # -------- DELETE OLD PAYMENT INSTRUCTION MESSAGE ----------
-                try:
-                    old_chat = p.get("chat_id")
-                    old_msg = p.get("message_id")
-                    if old_chat and old_msg:
-                        await context.bot.delete_message(old_chat, old_msg)
-                except Exception as e:
-                    print("Failed to delete old instruction message:", e)
-
-                # -------- STOP COUNTDOWN ----------
-                task = COUNTDOWN_TASKS.get(p["payment_id"])
-                if task:
-                    task.cancel()
-                    COUNTDOWN_TASKS.pop(p["payment_id"], None)
-
-                # -------- UPDATE STATUS TO UNDER REVIEW ----------
-                p["status"] = "review"
-                save_db(DB)
-
-                # -------- SAVE PROOF FILE ----------
-                file_obj = msg.photo[-1] if msg.photo else msg.document
-                file = await file_obj.get_file()
-                save_path = DATA_DIR / f"proof_{user_id}_{int(time.time())}.jpg"
-                await file.download_to_drive(str(save_path))
-                p.setdefault("proof_files", []).append(str(save_path))
-                save_db(DB)
-
-                # -------- FORWARD TO ADMIN ----------
-                buttons = InlineKeyboardMarkup([
-                    [
-                        InlineKeyboardButton("✅ APPROVE", callback_data=f"approve:{p['payment_id']}"),
-                        InlineKeyboardButton("❌ DECLINE", callback_data=f"decline:{p['payment_id']}")
-                    ]
-                ])
-
-                caption = (
-                    f"🔎 UNDER REVIEW\n"
-                    f"User: {user_id}\n"
-                    f"Package: {p['package']}"
-                )
+                    caption = (
+                        f"🔎 UNDER REVIEW\n"
+                        f"User: {user_id}\n"
+                        f"Package: {p['package']}"
+                    )
 
-                with open(save_path, "rb") as f:
+                    # photos are already on Telegram's side -> resend by file_id
                     await context.bot.send_photo(
-                        chat_id=SETTINGS["admin_chat_id"],
-                        photo=f,
+                        chat_id=ADMIN_ID,
+                        photo=msg.photo[-1].file_id if msg.photo else data,
                         caption=caption,
                         reply_markup=buttons
                     )
 
 
 
-                # -------- AUTO-DELETE USER'S UPLOADED SCREENSHOT ----------
-                try:
-                    await context.bot.delete_message(chat_id=user_id, message_id=msg.message_id)
-                except:
-                    pass
-
-                # -------- SEND UNDER REVIEW MESSAGE TO USER ----------
-                return await context.bot.send_message(
-                    chat_id=user_id,
-                    text="⏳ **Payment Under Review**\n\nYour payment proof is received.\nAdmin is verifying it — please wait.\n\nYou’ll get access automatically once approved ✅",
-                    parse_mode="Markdown"
-                )
+                    # -------- AUTO-DELETE USER'S UPLOADED SCREENSHOT ----------
+                    try:
+                        await context.bot.delete_message(chat_id=user_id, message_id=msg.message_id)
+                    except:
+                        pass
+
+                    # -------- SEND UNDER REVIEW MESSAGE TO USER ----------
+                    return await context.bot.send_message(
+                        chat_id=user_id,
+                        text=UNDER_REVIEW_TEXT,
+                        parse_mode="Markdown"
+                    )
 
 
 
 def is_admin(update):
     if update.effective_user:
-        return update.effective_user.id == SETTINGS["admin_chat_id"]
+        return update.effective_user.id == ADMIN_ID
     return False
 
 
+def admin_only(handler):
+    # ignore admin commands from anyone else; still answer their button taps
+    # so the client doesn't spin until Telegram times the query out
+    @wraps(handler)
+    async def wrapper(update, context):
+        if update.effective_chat.id != ADMIN_ID:
+            if update.callback_query:
+                await update.callback_query.answer("Not authorized", show_alert=False)
+            return
+        return await handler(update, context)
+    return wrapper
+
+
 # -------------------- Admin Command Functions (Preserved) --------------------
 
 # reminder_analytics_from_button
@@ -816,38 +1202,16 @@ async def reminder_analytics_from_button(query):
 
 # Stats (button-safe)
 async def stats_cmd_from_button(query, context):
-    total_users = len(USERS)
-    total_sales = len([p for p in DB["payments"] if p["status"] == "verified"])
-    total_pending = len([p for p in DB["payments"] if p["status"] == "pending"])
-    total_expired = len([p for p in DB["payments"] if p["status"] == "expired"])
-    total_declined = len([p for p in DB["payments"] if p["status"] == "declined"])
-
-    income = 0
-    for p in DB["payments"]:
-        if p["status"] == "verified":
-            price = SETTINGS["prices"].get(p["package"], {}).get("upi")
-            if price:
-                income += price
-
-
-    text = (
-        "📊 **BOT SALES STATISTICS**\n\n"
-        f"👥 Users: {total_users}\n"
-        f"✅ Sales: {total_sales}\n"
-        f"🟡 Pending: {total_pending}\n"
-        f"⛔ Declined: {total_declined}\n"
-        f"⌛ Expired: {total_expired}\n\n"
-        f"💰 Income: ₹{income}"
+    await query.message.reply_text(
+        STATS_BUTTON_TEXT.format(**stats_counts()), parse_mode="HTML"
     )
 
-    await query.message.reply_text(text, parse_mode="Markdown")
-
 async def adminpanel_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     data = query.data
 
     # Only admin access
-    if query.from_user.id != SETTINGS["admin_chat_id"]:
+    if query.from_user.id != ADMIN_ID:
         await query.answer("Not allowed.", show_alert=True)
         return
 
@@ -922,16 +1286,14 @@ async def adminpanel_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     # Show Pending Payments
     if data == "admin_pending":
-        pendings = [p for p in DB["payments"] if p["status"] == "pending"]
-
-        if not pendings:
+        if not PENDING:
             await query.message.reply_text("🟡 No pending payments.")
             await query.answer()
 
             return
 
         msg = "🟡 *Pending Payments:*\n\n"
-        for p in pendings:
+        for p in PENDING.values():
             msg += (
                 f"🆔 ID: `{p['payment_id']}`\n"
                 f"👤 User: `{p['user_id']}`\n"
@@ -951,21 +1313,23 @@ async def adminpanel_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
 
+@admin_only
 async def setlink(update, context):
-    if update.effective_chat.id != SETTINGS["admin_chat_id"]: return
     if len(context.args) < 2: return await update.message.reply_text("/setlink <pkg> <link>")
     SETTINGS['links'][context.args[0]] = context.args[1]
-    save_settings(SETTINGS)
+    mark_settings_dirty()
     await update.message.reply_text(f"Link updated for {context.args[0]}")
 
+@admin_only
 async def setprice(update, context):
-    if update.effective_chat.id != SETTINGS["admin_chat_id"]: return
     if len(context.args) < 3: return await update.message.reply_text("/setprice <pkg> <upi/crypto_usd> <val>")
     pkg, method, val = context.args[0], context.args[1], int(context.args[2])
     SETTINGS['prices'][pkg][method] = val
-    save_settings(SETTINGS)
+    mark_settings_dirty()
+    build_package_keyboards()
     await update.message.reply_text("Price updated.")
 
+@admin_only
 async def admin_review_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     action, pay_id = query.data.split(":")
@@ -977,99 +1341,100 @@ async def admin_review_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         COUNTDOWN_TASKS.pop(pay_id, None)
 
     # FIND PAYMENT RECORD
-    for p in DB["payments"]:
-        if p["payment_id"] == pay_id:
+    p = PAY_INDEX.get(pay_id)
+    if p:
 
-            user_id = p["user_id"]
-            package = p["package"]
+        user_id = p["user_id"]
+        package = p["package"]
 
-            # Detect amount
-            if p["method"] == "crypto":
-                amount = f"${SETTINGS['prices'][package]['crypto_usd']}"
-            else:
-                amount = f"₹{SETTINGS['prices'][package]['upi']}"
-
-            # -------------------- APPROVE --------------------
-            if action == "approve":
-
-                # Must be under review
-                if p["status"] != "review":
-                    await query.answer("Payment is not under review.", show_alert=True)
-                    return
+        # Detect amount
+        prices = SETTINGS['prices'][package]
+        if p["method"] == "crypto":
+            amount = f"${prices['crypto_usd']}"
+        else:
+            amount = f"₹{prices['upi']}"
 
-                p["status"] = "verified"
-                
+        # -------------------- APPROVE --------------------
+        if action == "approve":
 
-                save_db(DB)
+            # Must be under review
+            if p["status"] != "review":
+                await query.answer("Payment is not under review.", show_alert=True)
+                return
 
-                # Update admin message
-                try:
-                    await query.edit_message_caption(
-                        caption=(
-                            f"✅ Approved Payment\n"
-                            f"User: {user_id}\n"
-                            f"Package: {package.upper()}\n"
-                            f"Amount: {amount}"
-                        ),
-                        reply_markup=None
-                    )
-                except:
-                    await query.edit_message_text(
-                        f"✅ Approved Payment\nUser: {user_id}\nPackage: {package.upper()}\nAmount: {amount}",
-                        reply_markup=None
-                    )
+            set_status(p, "verified")
+            
 
-                # SEND ACCESS LINK
-                await send_link_to_user(user_id, package)
+            mark_dirty(p)
 
-                # Notify admin
-                await context.bot.send_message(
-                    SETTINGS["admin_chat_id"],
-                    f"✅ Payment Approved (ID: {pay_id}) | User: {user_id} | Amount: {amount}"
+            # Update admin message
+            try:
+                await query.edit_message_caption(
+                    caption=(
+                        f"✅ Approved Payment\n"
+                        f"User: {user_id}\n"
+                        f"Package: {package.upper()}\n"
+                        f"Amount: {amount}"
+                    ),
+                    reply_markup=None
+                )
+            except:
+                await query.edit_message_text(
+                    f"✅ Approved Payment\nUser: {user_id}\nPackage: {package.upper()}\nAmount: {amount}",
+                    reply_markup=None
                 )
-                return
 
+            # SEND ACCESS LINK
+            await send_link_to_user(user_id, package)
 
-            # -------------------- DECLINE --------------------
-            if action == "decline":
+            # Notify admin
+            await context.bot.send_message(
+                ADMIN_ID,
+                f"✅ Payment Approved (ID: {pay_id}) | User: {user_id} | Amount: {amount}"
+            )
+            return
 
-                # Must be under review
-                if p["status"] != "review":
-                    await query.answer("Payment is not under review.", show_alert=True)
-                    return
 
-                p["status"] = "declined"
-                save_db(DB)
+        # -------------------- DECLINE --------------------
+        if action == "decline":
 
-                # Update admin message
-                try:
-                    await query.edit_message_caption(
-                        caption=(
-                            f"❌ Declined Payment\n"
-                            f"User: {user_id}\n"
-                            f"Package: {package.upper()}\n"
-                            f"Amount: {amount}"
-                        ),
-                        reply_markup=None
-                    )
-                except:
-                    await query.edit_message_text(
-                        f"❌ Declined Payment\nUser: {user_id}\nPackage: {package.upper()}\nAmount: {amount}",
-                        reply_markup=None
-                    )
+            # Must be under review
+            if p["status"] != "review":
+                await query.answer("Payment is not under review.", show_alert=True)
+                return
 
-                # Notify user
-                await context.bot.send_message(
-                    user_id,
-                    "❌ Payment Declined.\nPlease send correct proof or try again."
-                )
+            set_status(p, "declined")
+            mark_dirty(p)
 
-                # Notify admin
-                await context.bot.send_message(
-                    SETTINGS["admin_chat_id"],
-                    f"❌ Payment Declined (ID: {pay_id}) | User: {user_id} | Amount: {amount}"
+            # Update admin message
+            try:
+                await query.edit_message_caption(
+                    caption=(
+                        f"❌ Declined Payment\n"
+                        f"User: {user_id}\n"
+                        f"Package: {package.upper()}\n"
+                        f"Amount: {amount}"
+                    ),
+                    reply_markup=None
                 )
-                return
+            except:
+                await query.edit_message_text(
+                    f"❌ Declined Payment\nUser: {user_id}\nPackage: {package.upper()}\nAmount: {amount}",
+                    reply_markup=None
+                )
+
+            # Notify user
+            await context.bot.send_message(
+                user_id,
+                "❌ Payment Declined.\nPlease send correct proof or try again."
+            )
+
+            # Notify admin
+            await context.bot.send_message(
+                ADMIN_ID,
+                f"❌ Payment Declined (ID: {pay_id}) | User: {user_id} | Amount: {amount}"
+            )
+            return
 
 
 
@@ -1111,11 +1476,14 @@ async def send_link_to_user(user_id: int, package: str):
 
 
 
+@lru_cache(maxsize=16)
 def build_manual_payment_text(package, method):
+    # depends only on SETTINGS; mark_settings_dirty() clears the cache
     pi = SETTINGS['payment_info']
+    prices = SETTINGS['prices'][package]
 
     if method == "crypto":
-        usd = SETTINGS['prices'][package]['crypto_usd']
+        usd = prices['crypto_usd']
         return (
             f"💱 **Crypto Payment Instructions**\n\n"
             f"Amount: **${usd} USDT**\n"
@@ -1126,7 +1494,7 @@ def build_manual_payment_text(package, method):
         )
 
     # ✅ UPDATED REMITLY INSTRUCTIONS
-    amount_inr = SETTINGS['prices'][package]['remitly']
+    amount_inr = prices['remitly']
     return (
         f"🌍 **Remitly Payment Instructions**\n\n"
         f"Amount to Send: **₹{amount_inr} INR**\n\n"
@@ -1145,25 +1513,40 @@ def build_manual_payment_text(package, method):
 
 
 # -------------------- Webhook (Auto-Approve UPI) --------------------
-@app.route('/razorpay_webhook', methods=['POST'])
-def razorpay_webhook():
+WEBHOOK_TASKS = set()  # strong refs so fire-and-forget deliveries aren't GC'd
+# keyed once; each request copies it instead of re-deriving the pads
+WEBHOOK_HMAC = hmac.new(RAZORPAY_WEBHOOK_SECRET.encode(), digestmod=hashlib.sha256)
+WEBHOOK_EVENT_RE = re.compile(rb'"event"\s*:\s*"([^"]+)"')
+
+async def razorpay_webhook(request):
 
     # ---------------- SIGNATURE VERIFICATION ----------------
     received_sig = request.headers.get("X-Razorpay-Signature", "")
-    body = request.data
+    body = await request.read()
+
+    h = WEBHOOK_HMAC.copy()
+    h.update(body)
+    calc_sig = h.digest()
 
-    calc_sig = hmac.new(
-        bytes(RAZORPAY_WEBHOOK_SECRET, 'utf-8'),
-        body,
-        hashlib.sha256
-    ).hexdigest()
+    try:
+        received_sig = bytes.fromhex(received_sig)
+    except ValueError:
+        received_sig = b""
 
     if not hmac.compare_digest(received_sig, calc_sig):
-        print("❌ Invalid Razorpay Signature")
-        return jsonify({"status": "invalid signature"}), 400
+        log.warning("❌ Invalid Razorpay Signature")
+        return web.json_response({"status": "invalid signature"}, status=400)
 
     # ---------------- VALIDATED PAYLOAD ----------------
-    data = request.json
+    # only qr_code.credited matters; ack everything else without parsing it.
+    # Look only ahead of "payload" (nested entities/notes may carry their own
+    # "event" key); no match there -> parse and read the real top-level key
+    cut = body.find(b'"payload"')
+    m = WEBHOOK_EVENT_RE.search(body, 0, cut if cut >= 0 else len(body))
+    if m and m.group(1) != b"qr_code.credited":
+        return web.json_response({"status": "ok"})
+
+    data = orjson.loads(body)
 
     if data.get('event') == 'qr_code.credited':
         qr_entity = data['payload']['qr_code']['entity']
@@ -1171,66 +1554,76 @@ def razorpay_webhook():
         user_id = int(qr_entity['notes']['user_id'])
         package = qr_entity['notes']['package']
 
-        for p in DB["payments"]:
-            if p.get("razorpay_qr_id") == qr_id:
-                if p["status"] != "pending":
-                    return jsonify({"status": "duplicate"}), 200
-                
-                p["status"] = "verified"
-               
-
-                clear_user_reminders(user_id)
-                save_db(DB)
-
-                # STOP countdown if running
-                task = COUNTDOWN_TASKS.get(p["payment_id"])
-                if task:
-                    task.cancel()
-                    COUNTDOWN_TASKS.pop(p["payment_id"], None)
-
-                # SEND ACCESS LINK
-                if BOT_LOOP:
-                    asyncio.run_coroutine_threadsafe(
-                        send_link_to_user(user_id, package),
-                        BOT_LOOP
-                    )
+        p = QR_INDEX.get(qr_id)
+        if p:
+            if p["status"] != "pending":
+                return web.json_response({"status": "duplicate"})
+            
+            set_status(p, "verified")
+            # money path: the credit must be on disk before Razorpay gets its ACK
+            try:
+                await persist_now(p)
+            except Exception:
+                log.exception("Could not persist credited payment %s", p["payment_id"])
+                set_status(p, "pending")  # let Razorpay's retry redo it
+                mark_dirty(p)
+                return web.json_response({"status": "error"}, status=500)
 
-                # DELETE QR MESSAGE (main QR)
-                try:
-                    chat_id = p.get("chat_id")
-                    msg_id = p.get("message_id")
-                    if chat_id and msg_id:
-                        asyncio.run_coroutine_threadsafe(
-                            BOT.delete_message(chat_id, msg_id),
-                            BOT_LOOP
-                        )
-                except Exception as e:
-                    print("QR delete error:", e)
+            clear_user_reminders(user_id)
 
-                # DELETE loading messages ("Creating QR...", "Sending QR...")
-                try:
-                    if p.get("loading_msg_ids"):
-                        for mid in p["loading_msg_ids"]:
-                            asyncio.run_coroutine_threadsafe(
-                                BOT.delete_message(p["user_id"], mid),
-                                BOT_LOOP
-                            )
-                except Exception as e:
-                    print("Loading delete error:", e)
+            # STOP countdown if running
+            task = COUNTDOWN_TASKS.get(p["payment_id"])
+            if task:
+                task.cancel()
+                COUNTDOWN_TASKS.pop(p["payment_id"], None)
+
+            # ACK Razorpay now; Telegram calls run after the response
+            task = asyncio.create_task(deliver_verified_payment(p, user_id, package))
+            WEBHOOK_TASKS.add(task)
+            task.add_done_callback(WEBHOOK_TASKS.discard)
+
+
+    return web.json_response({"status": "ok"})
+
+
+async def deliver_verified_payment(p, user_id, package):
+    # access link, QR delete and loading deletes are independent -> one round
+    calls = [("Send link", send_link_to_user(user_id, package))]
+
+    # DELETE QR MESSAGE (main QR)
+    chat_id = p.get("chat_id")
+    msg_id = p.get("message_id")
+    if chat_id and msg_id:
+        calls.append(("QR delete", BOT.delete_message(chat_id, msg_id)))
+
+    # DELETE loading messages ("Creating QR...", "Sending QR...")
+    for mid in p.get("loading_msg_ids") or ():
+        calls.append(("Loading delete", BOT.delete_message(p["user_id"], mid)))
+
+    results = await asyncio.gather(*(c for _, c in calls), return_exceptions=True)
+    for (what, _), res in zip(calls, results):
+        if isinstance(res, Exception):
+            log.warning("%s error: %s", what, res)
 
-                break
 
-    return jsonify({"status": "ok"}), 200
+async def start_web_server(application):
+    # aiohttp runs on the bot's own loop -> no thread, no cross-loop hops
+    web_app = web.Application()
+    web_app.router.add_post("/razorpay_webhook", razorpay_webhook)
+
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    site = web.TCPSite(runner, "0.0.0.0", int(os.environ.get("PORT", 8080)))
+    await site.start()
+    application.bot_data["web_runner"] = runner
 
 # -------------------- Startup --------------------
-async def start_countdown(payment_id: str, chat_id: int, message_id: int, seconds: int):
+async def start_countdown(payment_id: str, chat_id: int, message_id: int, caption_text: str, seconds: int):
     global COUNTDOWN_TASKS
 
     # Find payment entry
-    for p in DB["payments"]:
-        if p["payment_id"] == payment_id:
-            break
-    else:
+    p = PAY_INDEX.get(payment_id)
+    if not p:
         return
 
     while seconds > 0:
@@ -1238,7 +1631,7 @@ async def start_countdown(payment_id: str, chat_id: int, message_id: int, second
             return
 
         timer_text = f"{seconds//60:02d}:{seconds%60:02d}"
-        new_text = p["caption_text"] + f"\n\n⏳ **Time Left:** {timer_text}"
+        new_text = caption_text + f"\n\n⏳ **Time Left:** {timer_text}"
 
         try:
             if p["method"] == "upi":
@@ -1259,7 +1652,7 @@ async def start_countdown(payment_id: str, chat_id: int, message_id: int, second
                     parse_mode="Markdown"
                 )
         except Exception as e:
-            print("Ignored error:", e)
+            log.warning("Ignored error: %s", e)
 
         await asyncio.sleep(30)
         seconds -= 30
@@ -1267,14 +1660,14 @@ async def start_countdown(payment_id: str, chat_id: int, message_id: int, second
 
     # TIMEOUT HANDLING
     if p["status"] == "pending":
-        p["status"] = "expired"
-        save_db(DB)
+        set_status(p, "expired")
+        mark_dirty(p)
 
         # Delete payment message
         try:
             await BOT.delete_message(chat_id, message_id)
         except Exception as e:
-            print("Ignored error:", e)
+            log.warning("Ignored error: %s", e)
 
         # Notify user
         try:
@@ -1284,51 +1677,37 @@ async def start_countdown(payment_id: str, chat_id: int, message_id: int, second
                 parse_mode="Markdown"
             )
         except Exception as e:
-            print("Ignored error:", e)
+            log.warning("Ignored error: %s", e)
 
 
 
 async def post_init(application):
-    global BOT_LOOP
-    BOT_LOOP = asyncio.get_running_loop()
+    global HTTP
+    HTTP = make_razorpay_client()
+    await start_web_server(application)
     application.bot_data["reminder_task"] = asyncio.create_task(reminder_loop())
+    application.bot_data["flush_task"] = asyncio.create_task(flush_loop())
 
 async def shutdown(application):
     task = application.bot_data.get("reminder_task")
     if task:
         task.cancel()
-
-
-
-def run_flask():
-    app.run(
-        host="0.0.0.0",
-        port=int(os.environ.get("PORT", 8080)),
-        threaded=False,
-        use_reloader=False
-    )
-
-async def adminpanel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_chat.id != SETTINGS["admin_chat_id"]:
-        return  # Block non-admins
-
-    text = (
-        "🛠 **ADMIN PANEL**\n"
-        "Manage prices, links, and payments.\n\n"
-        "Available Commands:\n"
-        "——————————————\n"
-        "🔗 `/setlink <package> <link>`\n"
-        "– Set access link for VIP / DARK / BOTH\n\n"
-        "💰 `/setprice <package> <upi/crypto_usd> <value>`\n"
-        "– Change prices instantly\n\n"
-        "📄 `/pending`  (optional, I can add)\n"
-        "– View all pending payments\n\n"
-        "📊 `/stats` (optional)\n"
-        "– Overview of sales\n\n"
-        "⚙️ More features can be added anytime.\n"
-    )
-
-    keyboard = InlineKeyboardMarkup([
+    runner = application.bot_data.get("web_runner")
+    if runner:
+        await runner.cleanup()
+    # wait out any in-flight append so it can't land after the final snapshot
+    async with DB_ALOCK:
+        task = application.bot_data.get("flush_task")
+        if task:
+            task.cancel()
+        flush_now()
+    if HTTP is not None:
+        await HTTP.aclose()
+    PIL_POOL.shutdown(wait=False, cancel_futures=True)
+
+
+
+ADMIN_PANEL_KB = InlineKeyboardMarkup([
     [
         InlineKeyboardButton("🔗 Set VIP Link", callback_data="admin_setlink_vip"),
         InlineKeyboardButton("🔗 Set DARK Link", callback_data="admin_setlink_dark"),
@@ -1356,22 +1735,35 @@ async def adminpanel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ])
 
 
+@admin_only
+async def adminpanel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = (
+        "🛠 **ADMIN PANEL**\n"
+        "Manage prices, links, and payments.\n\n"
+        "Available Commands:\n"
+        "——————————————\n"
+        "🔗 `/setlink <package> <link>`\n"
+        "– Set access link for VIP / DARK / BOTH\n\n"
+        "💰 `/setprice <package> <upi/crypto_usd> <value>`\n"
+        "– Change prices instantly\n\n"
+        "📄 `/pending`  (optional, I can add)\n"
+        "– View all pending payments\n\n"
+        "📊 `/stats` (optional)\n"
+        "– Overview of sales\n\n"
+        "⚙️ More features can be added anytime.\n"
+    )
 
-    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=keyboard)
+    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=ADMIN_PANEL_KB)
 # -------------------- ADMIN EXTRA COMMANDS --------------------
 
+@admin_only
 async def pending_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_chat.id != SETTINGS["admin_chat_id"]:
-        return
-
-    pendings = [p for p in DB["payments"] if p["status"] == "pending"]
-
-    if not pendings:
+    if not PENDING:
         await update.message.reply_text("🟡 No pending payments.")
         return
 
     text = "🟡 *Pending Payments:*\n\n"
-    for p in pendings:
+    for p in PENDING.values():
         text += (
             f"🆔 ID: `{p['payment_id']}`\n"
             f"👤 User: `{p['user_id']}`\n"
@@ -1385,37 +1777,9 @@ async def pending_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 
+@admin_only
 async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_chat.id != SETTINGS["admin_chat_id"]:
-        return
-    total_users = len(USERS) 
-    total_sales = len([p for p in DB["payments"] if p["status"] == "verified"])
-    total_pending = len([p for p in DB["payments"] if p["status"] == "pending"])
-    total_expired = len([p for p in DB["payments"] if p["status"] == "expired"])
-    total_declined = len([p for p in DB["payments"] if p["status"] == "declined"])
-
-    # INCOME
-    income = 0
-    for p in DB["payments"]:
-        if p["status"] == "verified":
-            if p["package"] == "both":
-                income += SETTINGS["prices"]["both"]["upi"]
-            else:
-                income += SETTINGS["prices"][p["package"]]["upi"]
-
-    text = (
-        "📊 **BOT SALES STATISTICS**\n\n"
-        f"👥 **Total Users Started Bot:** {total_users}\n\n"
-        f"✅ Verified Payments: *{total_sales}*\n"
-        f"🟡 Pending Payments: *{total_pending}*\n"
-        f"⛔ Declined: *{total_declined}*\n"
-        f"⌛ Expired: *{total_expired}*\n\n"
-        f"💰 **Total Income:** ₹{income}\n"
-        "———————————————\n"
-        "Use /pending to view open payments."
-    )
-
-    await update.message.reply_text(text, parse_mode="Markdown")
+    await update.message.reply_text(STATS_TEXT.format(**stats_counts()), parse_mode="HTML")
 
     
 async def reminder_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1442,7 +1806,7 @@ async def reminder_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
     # If already paid, no reminders
-    if any(p["user_id"] == user_id and p["status"] == "verified" for p in DB["payments"]):
+    if any(p["status"] == "verified" for p in USER_PAYMENTS.get(user_id, ())):
         return await update.message.reply_text(
             "✅ You already have access. No reminders needed."
         )
@@ -1469,11 +1833,11 @@ async def status_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         is_callback = False
 
     # Find latest payment
-    user_payments = [p for p in DB["payments"] if p["user_id"] == user_id]
+    user_payments = USER_PAYMENTS.get(user_id)
     if not user_payments:
         return await reply_func(
-            "❌ No payment found.\nStart with /start",
-            reply_markup=back_keyboard() if is_callback else None
+            NO_PAYMENT_TEXT,
+            reply_markup=BACK_KB if is_callback else None
         )
 
     p = user_payments[-1]
@@ -1513,67 +1877,64 @@ async def status_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await reply_func(
         text,
-        reply_markup=back_keyboard() if is_callback else None
+        reply_markup=BACK_KB if is_callback else None
     )
 
     
-async def broadcast_to_users(bot, user_ids, update, context):
-    delivered = 0
-    failed = 0
+BROADCAST_CONCURRENCY = 20  # in-flight sends; the bot's AIORateLimiter paces them
+BROADCAST_RETRIES = 3       # attempts per user when Telegram answers RetryAfter
 
-    for uid in user_ids:
-        try:
-            # PHOTO
-            if update.message.photo:
-                await bot.send_photo(
-                    uid,
-                    update.message.photo[-1].file_id,
-                    caption=(update.message.caption or "").replace("/broadcast_all", "")
-                    .replace("/broadcast_buyers", "")
-                    .replace("/broadcast_nonbuyers", "").strip()
 
-                )
+def strip_broadcast_cmd(text):
+    # remove only the broadcast command
+    return (
+        text.replace("/broadcast_all", "")
+            .replace("/broadcast_buyers", "")
+            .replace("/broadcast_nonbuyers", "")
+            .strip()
+    )
 
-            # DOCUMENT
-            elif update.message.document:
-                await bot.send_document(
-                    uid,
-                    update.message.document.file_id,
-                    caption=(
-                        (update.message.caption or "")
-                        .replace("/broadcast_all", "")
-                        .replace("/broadcast_buyers", "")
-                        .replace("/broadcast_nonbuyers", "")
-                        .strip()
-                    )
-                )
 
+async def broadcast_to_users(bot, user_ids, update, context):
+    msg = update.message
+    user_ids = tuple(user_ids)  # frozen audience; /start may add users mid-broadcast
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    caption = strip_broadcast_cmd(msg.caption or "")
+    text = strip_broadcast_cmd(msg.text) if msg.text else None
+    if not msg.photo and not msg.document and text is None:
+        user_ids = ()  # nothing to send; still report 0/0
+
+    async def send_one(uid):
+        async with sem:
+            for _ in range(BROADCAST_RETRIES):
+                try:
+                    # PHOTO
+                    if msg.photo:
+                        await bot.send_photo(uid, msg.photo[-1].file_id, caption=caption)
 
+                    # DOCUMENT
+                    elif msg.document:
+                        await bot.send_document(uid, msg.document.file_id, caption=caption)
 
-            
-            # TEXT (preserve new lines)
-            else:
-                text = update.message.text
-                if not text:
-                    continue
-
-                # remove only the broadcast command
-                text = (
-                    text.replace("/broadcast_all", "")
-                        .replace("/broadcast_buyers", "")
-                        .replace("/broadcast_nonbuyers", "")
-                        .strip()
-                )
+                    # TEXT (preserve new lines)
+                    else:
+                        await bot.send_message(uid, text)
+
+                    return True
 
-                await bot.send_message(uid, text)
+                except RetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
 
+                except Exception as e:
+                    log.warning("Broadcast failed to %s: %s", uid, e)
+                    return False
 
-            delivered += 1
-            await asyncio.sleep(0.05)
+            log.warning("Broadcast failed to %s: still rate limited", uid)
+            return False
 
-        except Exception as e:
-            failed += 1
-            print(f"Broadcast failed to {uid}: {e}")
+    results = await asyncio.gather(*(send_one(uid) for uid in user_ids))
+    delivered = results.count(True)
+    failed = results.count(False)
 
     await update.message.reply_text(
         f"📢 **Broadcast Completed**\n"
@@ -1583,34 +1944,43 @@ async def broadcast_to_users(bot, user_ids, update, context):
     )
 
 
+@admin_only
 async def broadcast_all(update, context):
-    if update.effective_chat.id != SETTINGS["admin_chat_id"]:
-        return
     await broadcast_to_users(BOT, USERS, update, context)
     
     
+@admin_only
 async def broadcast_buyers(update, context):
-    if update.effective_chat.id != SETTINGS["admin_chat_id"]:
-        return
     await broadcast_to_users(BOT, get_buyer_ids(), update, context)
     
     
+@admin_only
 async def broadcast_nonbuyers(update, context):
-    if update.effective_chat.id != SETTINGS["admin_chat_id"]:
-        return
     await broadcast_to_users(BOT, get_nonbuyer_ids(), update, context)
 
-async def setremitlyhowto(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_chat.id != SETTINGS["admin_chat_id"]:
-        return
 
+# photo/document captioned with a broadcast command; one regex run per media update
+BROADCAST_CAPTION_RE = re.compile(r"^/broadcast_(all|buyers|nonbuyers)?")
+BROADCAST_MEDIA = {
+    "all": broadcast_all,
+    "buyers": broadcast_buyers,
+    "nonbuyers": broadcast_nonbuyers,
+}
+
+async def broadcast_media(update, context):
+    handler = BROADCAST_MEDIA.get(context.matches[0][1])
+    if handler:
+        return await handler(update, context)
+
+@admin_only
+async def setremitlyhowto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         return await update.message.reply_text(
             "Usage:\n/setremitlyhowto <link>"
         )
 
     SETTINGS["payment_info"]["remitly_how_to"] = context.args[0]
-    save_settings(SETTINGS)
+    mark_settings_dirty()
 
     await update.message.reply_text("✅ Remitly how-to-pay link updated successfully.")
 def get_due_reminders(r):
@@ -1658,6 +2028,35 @@ REMINDER_MESSAGES = {
     }
 }
 
+@lru_cache(maxsize=32)
+def reminder_keyboard(intent, package):
+    # only depends on (intent, package) -> one markup per pair
+    buttons = []
+
+    # PACKAGE CLICKED → show all
+    if intent == "package_clicked":
+        buttons = [
+            [InlineKeyboardButton("💸 Pay via UPI", callback_data=f"reminder_pay_upi:{package}")],
+            [InlineKeyboardButton("🪙 Crypto", callback_data=f"reminder_pay_crypto:{package}")],
+            [InlineKeyboardButton("🌍 Remitly", callback_data=f"reminder_pay_remitly:{package}")]
+        ]
+
+    # UPI CLICKED → UPI only
+    elif intent == "upi_clicked":
+        buttons = [
+            [InlineKeyboardButton("💸 Pay via UPI", callback_data=f"reminder_pay_upi:{package}")]
+        ]
+
+    # MANUAL CLICKED → Crypto + Remitly
+    elif intent == "manual_clicked":
+        buttons = [
+            [InlineKeyboardButton("🪙 Crypto", callback_data=f"reminder_pay_crypto:{package}")],
+            [InlineKeyboardButton("🌍 Remitly", callback_data=f"reminder_pay_remitly:{package}")]
+        ]
+
+    return InlineKeyboardMarkup(buttons)
+
+
 async def reminder_loop():
     global REMINDERS
     while True:
@@ -1665,8 +2064,8 @@ async def reminder_loop():
 
             # Stop if user already paid or under review
             if any(
-                p["user_id"] == r["user_id"] and p["status"] in ("review", "verified")
-                for p in DB["payments"]
+                p["status"] in ("review", "verified")
+                for p in USER_PAYMENTS.get(r["user_id"], ())
             ):
                 clear_user_reminders(r["user_id"])
                 continue
@@ -1677,33 +2076,10 @@ async def reminder_loop():
                 try:
                     msg = REMINDER_MESSAGES.get(r["intent"], {}).get(step)
 
-                    buttons = []
-
-                    # PACKAGE CLICKED → show all
-                    if r["intent"] == "package_clicked":
-                        buttons = [
-                            [InlineKeyboardButton("💸 Pay via UPI", callback_data=f"reminder_pay_upi:{r['package']}")],
-                            [InlineKeyboardButton("🪙 Crypto", callback_data=f"reminder_pay_crypto:{r['package']}")],
-                            [InlineKeyboardButton("🌍 Remitly", callback_data=f"reminder_pay_remitly:{r['package']}")]
-                        ]
-
-                    # UPI CLICKED → UPI only
-                    elif r["intent"] == "upi_clicked":
-                        buttons = [
-                            [InlineKeyboardButton("💸 Pay via UPI", callback_data=f"reminder_pay_upi:{r['package']}")]
-                        ]
-
-                    # MANUAL CLICKED → Crypto + Remitly
-                    elif r["intent"] == "manual_clicked":
-                        buttons = [
-                            [InlineKeyboardButton("🪙 Crypto", callback_data=f"reminder_pay_crypto:{r['package']}")],
-                            [InlineKeyboardButton("🌍 Remitly", callback_data=f"reminder_pay_remitly:{r['package']}")]
-                        ]
-
                     await BOT.send_message(
                         r["user_id"],
                         msg.format(pkg=r["package"].upper()),
-                        reply_markup=InlineKeyboardMarkup(buttons),
+                        reply_markup=reminder_keyboard(r["intent"], r["package"]),
                         parse_mode="Markdown"
                     )
 
@@ -1714,82 +2090,108 @@ async def reminder_loop():
                     r["sent"].append(step)
                     save_reminders(REMINDERS)
                 except Exception as e:
-                    print("Ignored error:", e)
+                    log.warning("Ignored error: %s", e)
 
 
         await asyncio.sleep(300)  # check every 5 minutes
 
 
-if __name__ == "__main__":
-    threading.Thread(target=run_flask, daemon=True).start()
+USER_COMMANDS = [
+    ("start", start_handler),
+    ("status", status_handler),
+    ("reminder_cancel", reminder_cancel),
+    ("reminder_start", reminder_start),
+]
+
+ADMIN_COMMANDS = [
+    ("setlink", setlink),
+    ("setprice", setprice),
+    ("adminpanel", adminpanel),
+    ("pending", pending_cmd),
+    ("stats", stats_cmd),
+    ("broadcast_all", broadcast_all),
+    ("broadcast_buyers", broadcast_buyers),
+    ("broadcast_nonbuyers", broadcast_nonbuyers),
+    ("setremitlyhowto", setremitlyhowto),
+]
+
+# approve:<id> | decline:<id> | admin_<action>; everything else is a user button
+CB_ROUTES = {
+    "approve": admin_review_handler,
+    "decline": admin_review_handler,
+    "admin": adminpanel_buttons,
+}
+
+async def dispatch_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    data = update.callback_query.data
+    if not data:
+        return
+    head = data.partition(":")[0].partition("_")[0]
+    return await CB_ROUTES.get(head, callback_handler)(update, context)
 
+
+def build_application():
+    global BOT
     application = (
         ApplicationBuilder()
         .token(TELEGRAM_TOKEN)
-        .post_init(post_init)
+        .concurrent_updates(True)
+        .rate_limiter(AIORateLimiter())  # queue bot calls under Telegram's flood limits
         .build()
     )
-
-    app_instance = application
     BOT = application.bot
 
-    # USER COMMANDS
-    application.add_handler(CommandHandler("start", start_handler))
-    application.add_handler(CommandHandler("status", status_handler))
-    application.add_handler(CommandHandler("reminder_cancel", reminder_cancel))
-    application.add_handler(CommandHandler("reminder_start", reminder_start))
-
-    # ADMIN COMMANDS
-    application.add_handler(CommandHandler("setlink", setlink))
-    application.add_handler(CommandHandler("setprice", setprice))
-    application.add_handler(CommandHandler("adminpanel", adminpanel))
-    application.add_handler(CommandHandler("pending", pending_cmd))
-    application.add_handler(CommandHandler("stats", stats_cmd))
-    application.add_handler(CommandHandler("broadcast_all", broadcast_all))
-    application.add_handler(CommandHandler("broadcast_buyers", broadcast_buyers))
-    application.add_handler(CommandHandler("broadcast_nonbuyers", broadcast_nonbuyers))
-    application.add_handler(CommandHandler("setremitlyhowto", setremitlyhowto))
-
-
-    # CALLBACKS
-    application.add_handler(
-        CallbackQueryHandler(
-            callback_handler,
-            pattern="^(choose_.*|pay_.*|reminder_pay_.*|cancel|help|status_.*|back_packages)$"
+    MEDIA = filters.PHOTO | filters.Document.ALL
 
-        )
-    )
-    application.add_handler(CallbackQueryHandler(admin_review_handler, pattern="^(approve|decline):"))
-    application.add_handler(CallbackQueryHandler(adminpanel_buttons, pattern="^admin_"))
-
-    # MEDIA HANDLERS
-    application.add_handler(
-        MessageHandler(
-            (filters.PHOTO | filters.Document.ALL) & ~filters.CaptionRegex("^/broadcast_"),
-            message_handler
-        )
+    # first match wins, so the busiest handlers go first
+    application.add_handlers(
+        # CALLBACKS (every button tap)
+        [CallbackQueryHandler(dispatch_callback)]
+        # MEDIA HANDLERS (payment proofs; broadcast media must precede the catch-all)
+        + [
+            MessageHandler(MEDIA & filters.CaptionRegex(BROADCAST_CAPTION_RE), broadcast_media),
+            MessageHandler(MEDIA, message_handler),
+        ]
+        # USER COMMANDS
+        + [CommandHandler(name, fn) for name, fn in USER_COMMANDS]
+        # ADMIN COMMANDS
+        + [CommandHandler(name, fn) for name, fn in ADMIN_COMMANDS]
     )
+    return application
 
-    application.add_handler(
-        MessageHandler(filters.PHOTO & filters.CaptionRegex("^/broadcast_all"), broadcast_all)
-    )
-    application.add_handler(
-        MessageHandler(filters.PHOTO & filters.CaptionRegex("^/broadcast_buyers"), broadcast_buyers)
-    )
-    application.add_handler(
-        MessageHandler(filters.PHOTO & filters.CaptionRegex("^/broadcast_nonbuyers"), broadcast_nonbuyers)
-    )
-    application.add_handler(
-        MessageHandler(filters.Document.ALL & filters.CaptionRegex("^/broadcast_all"), broadcast_all)
-    )
-    application.add_handler(
-        MessageHandler(filters.Document.ALL & filters.CaptionRegex("^/broadcast_buyers"), broadcast_buyers)
-    )
-    application.add_handler(
-        MessageHandler(filters.Document.ALL & filters.CaptionRegex("^/broadcast_nonbuyers"), broadcast_nonbuyers)
-    )
 
-    # 🔥 IMPORTANT
-    application.run_polling(
-        drop_pending_updates=True
-    )
+async def main():
+    # runs on the caller's loop, so it can sit next to another async server
+    application = build_application()
+
+    stop = asyncio.Event()
+    if sys.platform != "win32":
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+    async with application:  # initialize() / shutdown()
+        # shutdown() copes with a half-done post_init, so clean up whatever started
+        try:
+            await post_init(application)
+            await application.updater.start_polling(
+                drop_pending_updates=True,
+                allowed_updates=[Update.MESSAGE, Update.CALLBACK_QUERY],  # nothing else is handled
+                timeout=50,  # long-poll close to Telegram's cap -> fewer getUpdates round trips
+            )
+            await application.start()
+            await stop.wait()
+        finally:
+            if application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+            await shutdown(application)
+
+
+if __name__ == "__main__":
+    if sys.platform != "win32":
+        import uvloop
+        uvloop.install()  # asyncio.run() picks the uvloop policy up
+
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+for mod in ("telegram", "httpx", "aiohttp", "orjson", "msgpack", "segno", "PIL"):
+    pytest.importorskip(mod)
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def boot(data_dir, code=""):
+    # fresh interpreter per "restart"; os._exit skips atexit, i.e. a crash
+    script = "import telegram_payment_bot as bot\n" + code + "\nimport os; os._exit(0)\n"
+    env = dict(os.environ, DATA_DIR=str(data_dir))
+    subprocess.run([sys.executable, "-c", script], cwd=REPO, env=env, check=True)
+
+
+def test_torn_log_tail_without_complete_lines_is_compacted(tmp_path):
+    boot(tmp_path)  # first start writes the empty snapshot
+    (tmp_path / "payments.log").write_bytes(b'{"payment_id":"p_torn","user_id":1')
+
+    boot(tmp_path, """
+bot.add_payment({"payment_id": "p_c0", "user_id": 1, "package": "vip",
+                 "method": "upi", "status": "pending", "created_at": 0})
+bot.mark_dirty(bot.PAY_INDEX["p_c0"])
+bot.append_log_bytes(bot.dirty_log_blob())
+""")
+
+    boot(tmp_path, 'assert "p_c0" in bot.PAY_INDEX, "payment lost"')
+
+
+def test_empty_snapshot_falls_back_and_replays_log(tmp_path):
+    (tmp_path / "payments.mp").write_bytes(b"")
+    (tmp_path / "payments.log").write_bytes(
+        b'{"payment_id":"p_1","user_id":1,"package":"vip","method":"upi","status":"verified"}\n'
+    )
+    boot(tmp_path, 'assert bot.PAY_INDEX["p_1"]["status"] == "verified"')
+    assert (tmp_path / "payments.mp").stat().st_size